@@ -1,15 +1,68 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 import os
+import math
+import shutil
+import hashlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
+# JSON helpers work on bytes, using orjson when available and the stdlib otherwise
+try:
+    import orjson
+
+    def _dumps(obj, pretty: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    def _dumps(obj, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, indent=2).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    _loads = json.loads
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# Map control planes to their domains
+CONTROL_PLANE_DOMAINS = {
+    'us': 'anypoint.mulesoft.com',
+    'eu1': 'eu1.anypoint.mulesoft.com',
+    'gov': 'gov.anypoint.mulesoft.com'
+}
+
+# Authentication and API base URLs of each control plane
+CONTROL_PLANE_URLS = {
+    control_plane: (f"https://{domain}/accounts/api/v2/oauth2/token", f"https://{domain}/cloudhub/api")
+    for control_plane, domain in CONTROL_PLANE_DOMAINS.items()
+}
+
+TOKEN_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "mulesoft_downloader", "token.json")
+FILE_BUFFER_SIZE = 1024 * 1024
+ETAG_SUFFIX = ".etag"
+# Connect and read timeouts in seconds, so a stalled server cannot hang a worker forever
+REQUEST_TIMEOUT = (10, 60)
+
 class MulesoftDownloader:
     def __init__(self):
+        self._worker_output = threading.local()
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         self._load_config()
         self._setup_base_urls()
-        self.session = requests.Session()
+        self.session = self._create_session()
+        self._auth_lock = threading.Lock()
         self.download_dir = "downloads"
         self._setup_session()
         self._setup_download_dir()
@@ -30,11 +83,28 @@ class MulesoftDownloader:
             raise KeyError(f"Missing environment variables: {', '.join(missing_vars)}")
 
         self.enable_endpoint_logging = os.getenv('ENABLE_ENDPOINT_LOGGING', 'True').lower() == 'true'
+        self.enable_token_cache = os.getenv('ENABLE_TOKEN_CACHE', 'True').lower() == 'true'
+        self.pretty_json = os.getenv('PRETTY_JSON', 'False').lower() == 'true'
+        self.reuse_previous_downloads = os.getenv('REUSE_PREVIOUS_DOWNLOADS', 'True').lower() == 'true'
+
+        try:
+            self.max_workers = int(os.getenv('MAX_WORKERS', '8'))
+        except ValueError:
+            raise ValueError("MAX_WORKERS must be an integer")
+        if self.max_workers < 1:
+            raise ValueError("MAX_WORKERS must be at least 1")
+
+        try:
+            self.download_chunk_size = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(256 * 1024)))
+        except ValueError:
+            raise ValueError("DOWNLOAD_CHUNK_SIZE must be an integer")
+        if self.download_chunk_size < 1:
+            raise ValueError("DOWNLOAD_CHUNK_SIZE must be at least 1")
+
         self.control_plane = os.getenv('ANYPOINT_CONTROL_PLANE', 'us').lower()
         
-        valid_control_planes = ['us', 'eu1', 'gov']
-        if self.control_plane not in valid_control_planes:
-            raise ValueError(f"ANYPOINT_CONTROL_PLANE must be one of: {', '.join(valid_control_planes)}")
+        if self.control_plane not in CONTROL_PLANE_URLS:
+            raise ValueError(f"ANYPOINT_CONTROL_PLANE must be one of: {', '.join(CONTROL_PLANE_URLS)}")
             
         self.config = {
             'client_id': os.getenv('ANYPOINT_CLIENT_ID'),
@@ -42,112 +112,346 @@ class MulesoftDownloader:
             'organization_id': os.getenv('ANYPOINT_ORG_ID'),
             'environment_id': os.getenv('ANYPOINT_ENV_ID')
         }
+        self.org_id = self.config['organization_id']
+        self.env_id = self.config['environment_id']
 
     def _setup_base_urls(self) -> None:
         """Setup base URLs based on control plane"""
-        # Map control planes to their domains
-        control_plane_domains = {
-            'us': 'anypoint.mulesoft.com',
-            'eu1': 'eu1.anypoint.mulesoft.com',
-            'gov': 'gov.anypoint.mulesoft.com'
-        }
+        self.auth_url, self.base_url = CONTROL_PLANE_URLS[self.control_plane]
+        self.app_base = f"{self.base_url}/organizations/{self.org_id}/environments/{self.env_id}/applications"
         
-        base_domain = control_plane_domains[self.control_plane]
-            
-        self.auth_url = f"https://{base_domain}/accounts/api/v2/oauth2/token"
-        self.base_url = f"https://{base_domain}/cloudhub/api"
-        
-        if self.enable_endpoint_logging:
-            print(f"\nUsing control plane: {self.control_plane}")
-            print(f"Base URL: {self.base_url}")
+        self._log_endpoint("\nUsing control plane: %s\nBase URL: %s", self.control_plane, self.base_url)
+
+    def _create_session(self) -> requests.Session:
+        """Create HTTP session with a connection pool sized for the workers and retry/backoff"""
+        session = requests.Session()
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "POST"]
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.max_workers,
+            max_retries=retries
+        )
+        session.mount("https://", adapter)
+        return session
 
-    def _log_endpoint(self, message: str) -> None:
-        """Utility to log endpoints only if enabled"""
+    def _log_endpoint(self, message: str, *args) -> None:
+        """Utility to log endpoints only if enabled, formatting the message lazily"""
         if self.enable_endpoint_logging:
+            self._print(message % args if args else message)
+
+    def _print(self, message: str) -> None:
+        """Print a message, or hold it for the main thread when called from a download worker"""
+        lines = getattr(self._worker_output, 'lines', None)
+        if lines is not None:
+            lines.append(message)
+        else:
             print(message)
 
     def _setup_session(self) -> None:
         """Configure HTTP session with credentials and required headers"""
-        self._log_endpoint(f"\nCalling authentication endpoint: {self.auth_url}")
-        
-        auth_data = {
-            "grant_type": "client_credentials",
-            "client_id": self.config['client_id'],
-            "client_secret": self.config['client_secret']
-        }
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "x-anypnt-env-id": self.env_id,
+            "x-anypnt-org-id": self.org_id
+        })
+        self._authenticate(use_cache=True)
+
+    def _authenticate(self, use_cache: bool) -> None:
+        """Set the bearer token on the session, reusing a cached token when still valid"""
+        access_token = self._load_cached_token() if use_cache else None
+
+        if not access_token:
+            self._log_endpoint("\nCalling authentication endpoint: %s", self.auth_url)
+
+            auth_data = {
+                "grant_type": "client_credentials",
+                "client_id": self.config['client_id'],
+                "client_secret": self.config['client_secret']
+            }
+
+            try:
+                # Drop the session's JSON content type and any stale bearer token for this request
+                response = self.session.post(
+                    self.auth_url,
+                    data=auth_data,
+                    timeout=REQUEST_TIMEOUT,
+                    headers={"Authorization": None, "Content-Type": "application/x-www-form-urlencoded"}
+                )
+                response.raise_for_status()
+                token_data = _loads(response.content)
+                access_token = token_data["access_token"]
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise Exception(f"Error during authentication: {e}")
+
+            self._save_cached_token(access_token, token_data.get("expires_in"))
+
+        self.access_token = access_token
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+
+    def _reauthenticate(self, stale_token: str) -> None:
+        """Fetch a new token after a 401, once per stale token across all workers"""
+        with self._auth_lock:
+            if self.access_token == stale_token:
+                self._invalidate_cached_token()
+                self._authenticate(use_cache=False)
 
+    def _token_cache_key(self) -> str:
+        """Key identifying the cached token for this client and control plane"""
+        return hashlib.sha256(f"{self.config['client_id']}:{self.control_plane}".encode()).hexdigest()
+
+    def _read_token_cache(self) -> Dict:
+        """Read all cached tokens, ignoring a missing or unreadable cache file"""
         try:
-            response = requests.post(self.auth_url, data=auth_data)
-            response.raise_for_status()
-            access_token = response.json()["access_token"]
-            self.session.headers.update({
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-                "x-anypnt-env-id": self.config['environment_id'],
-                "x-anypnt-org-id": self.config['organization_id']
-            })
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error during authentication: {e}")
+            with open(TOKEN_CACHE_PATH, 'rb') as f:
+                cache = _loads(f.read())
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _write_token_cache(self, cache: Dict) -> None:
+        """Write the token cache readable only by the current user"""
+        try:
+            os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+            fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'wb') as f:
+                f.write(_dumps(cache))
+        except OSError as e:
+            self._print(f"Unable to write token cache: {e}")
+
+    def _load_cached_token(self) -> Optional[str]:
+        """Return the cached token if it is valid for at least another minute"""
+        if not self.enable_token_cache:
+            return None
+
+        # Any malformed entry counts as a cache miss
+        entry = self._read_token_cache().get(self._token_cache_key())
+        if not isinstance(entry, dict):
+            return None
+        token = entry.get('token')
+        expires_at = entry.get('expires_at')
+        if not isinstance(token, str) or not token:
+            return None
+        if isinstance(expires_at, bool) or not isinstance(expires_at, (int, float)) or not math.isfinite(expires_at):
+            return None
+        if expires_at - time.time() <= 60:
+            return None
+
+        self._log_endpoint("\nUsing cached access token")
+        return token
+
+    def _save_cached_token(self, access_token: str, expires_in: Optional[int]) -> None:
+        """Persist the token and its expiry time, skipping caching if the expiry is unusable"""
+        if not self.enable_token_cache or not expires_in:
+            return
+
+        try:
+            expires_at = time.time() + int(expires_in)
+        except (TypeError, ValueError, OverflowError):
+            return
+
+        cache = self._read_token_cache()
+        cache[self._token_cache_key()] = {
+            'token': access_token,
+            'expires_at': expires_at
+        }
+        self._write_token_cache(cache)
+
+    def _invalidate_cached_token(self) -> None:
+        """Drop the cached token for this client and control plane"""
+        if not self.enable_token_cache:
+            return
+
+        cache = self._read_token_cache()
+        if cache.pop(self._token_cache_key(), None) is not None:
+            self._write_token_cache(cache)
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET through the session, re-authenticating once if the token was rejected"""
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        access_token = self.access_token
+        response = self.session.get(url, **kwargs)
+        if response.status_code == 401:
+            response.close()
+            self._reauthenticate(access_token)
+            response = self.session.get(url, **kwargs)
+        return response
 
     def _setup_download_dir(self) -> None:
         """Create download directory if it doesn't exist"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.download_dir = f"downloads_{timestamp}"
+        self.download_dir = f"downloads_{self.timestamp}"
         os.makedirs(self.download_dir, exist_ok=True)
+        self.created_app_dirs = set()
+
+        # Earlier runs, newest first, whose JARs can be reused instead of downloaded again
+        self.previous_download_dirs = []
+        if self.reuse_previous_downloads:
+            self.previous_download_dirs = sorted(
+                (d for d in os.listdir('.')
+                 if d.startswith('downloads_') and d != self.download_dir and os.path.isdir(d)),
+                reverse=True
+            )
 
     def get_applications(self) -> list:
         """Retrieve the list of applications"""
         url = f"{self.base_url}/applications"
-        self._log_endpoint(f"\nCalling applications list endpoint: {url}")
-        
-        if self.enable_endpoint_logging:
-            print("Headers used:")
-            print(f"x-anypnt-env-id: {self.config['environment_id']}")
-            print(f"x-anypnt-org-id: {self.config['organization_id']}")
+        self._log_endpoint(
+            "\nCalling applications list endpoint: %s\nHeaders used:\nx-anypnt-env-id: %s\nx-anypnt-org-id: %s",
+            url, self.env_id, self.org_id
+        )
         
         try:
-            response = self.session.get(url)
+            response = self._get(url)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return _loads(response.content)
+        except (requests.exceptions.RequestException, ValueError) as e:
             raise Exception(f"Error retrieving applications: {e}")
 
     def get_application_info(self, app_name: str) -> Dict:
         """Retrieve detailed information for a single application"""
-        url = f"{self.base_url}/organizations/{self.config['organization_id']}/environments/{self.config['environment_id']}/applications/{app_name}"
-        self._log_endpoint(f"\nCalling application info endpoint: {url}")
+        url = f"{self.app_base}/{app_name}"
+        self._log_endpoint("\nCalling application info endpoint: %s", url)
         
         try:
-            response = self.session.get(url)
+            response = self._get(url)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return _loads(response.content)
+        except (requests.exceptions.RequestException, ValueError) as e:
             raise Exception(f"Error retrieving information for {app_name}: {e}")
 
     def download_application(self, app_name: str, filename: str) -> Optional[str]:
         """Download the JAR file for the application"""
-        url = f"{self.base_url}/organizations/{self.config['organization_id']}/environments/{self.config['environment_id']}/applications/{app_name}/download/{filename}"
-        self._log_endpoint(f"\nCalling application download endpoint: {url}")
+        url = f"{self.app_base}/{app_name}/download/{filename}"
+        self._log_endpoint("\nCalling application download endpoint: %s", url)
         
-        # Create specific directory for the application
-        app_dir = os.path.join(self.download_dir, app_name)
-        os.makedirs(app_dir, exist_ok=True)
+        # Directories are normally created up front by process_all_applications
+        if app_name not in self.created_app_dirs:
+            self._create_app_dirs([app_name])
         
-        output_path = os.path.join(app_dir, filename)
+        output_path = os.path.join(self.download_dir, app_name, filename)
+
+        previous_path = self._find_previous_download(app_name, filename)
+        previous_etag = self._read_etag(previous_path) if previous_path else None
+        headers = {"If-None-Match": previous_etag} if previous_etag else None
 
         try:
-            response = self.session.get(url, stream=True)
-            response.raise_for_status()
+            # The context manager hands the connection back to the pool on every exit path
+            with self._get(url, stream=True, headers=headers) as response:
+                response.raise_for_status()
+
+                if previous_path and self._matches_previous_download(response, previous_etag):
+                    self._reuse_previous_download(previous_path, output_path)
+                    self._print(f"Unchanged since {previous_path}, reused local copy")
+                    return output_path
 
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                # Copy straight from the raw stream, letting urllib3 undo any content encoding
+                response.raw.decode_content = True
+                with open(output_path, 'wb', buffering=FILE_BUFFER_SIZE) as f:
+                    shutil.copyfileobj(response.raw, f, length=self.download_chunk_size)
+
+                etag = response.headers.get('ETag')
+                if etag:
+                    with open(output_path + ETAG_SUFFIX, 'w', encoding='utf-8') as f:
+                        f.write(etag)
 
             return output_path
-        except requests.exceptions.RequestException as e:
-            print(f"Error downloading application {app_name}: {e}")
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            self._print(f"Error downloading application {app_name}: {e}")
             return None
 
+    def _create_app_dirs(self, app_names) -> None:
+        """Create the download directory of each application"""
+        for app_name in app_names:
+            os.makedirs(os.path.join(self.download_dir, app_name), exist_ok=True)
+            self.created_app_dirs.add(app_name)
+
+    def _find_previous_download(self, app_name: str, filename: str) -> Optional[str]:
+        """Return the most recent copy of the JAR downloaded by an earlier run, if any"""
+        for previous_dir in self.previous_download_dirs:
+            previous_path = os.path.join(previous_dir, app_name, filename)
+            if os.path.isfile(previous_path):
+                return previous_path
+        return None
+
+    def _read_etag(self, path: str) -> Optional[str]:
+        """Read the ETag saved next to a downloaded JAR"""
+        try:
+            with open(path + ETAG_SUFFIX, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _matches_previous_download(self, response: requests.Response, previous_etag: Optional[str]) -> bool:
+        """Check whether the server copy is the same as the previously downloaded one"""
+        # Only an ETag match counts, a rebuilt JAR can have the same size as the old one
+        if not previous_etag:
+            return False
+        if response.status_code == 304:
+            return True
+        return response.headers.get('ETag') == previous_etag
+
+    def _reuse_previous_download(self, previous_path: str, output_path: str) -> None:
+        """Hard link the previous JAR and its ETag into this run, copying if linking fails"""
+        for source, target in ((previous_path, output_path),
+                               (previous_path + ETAG_SUFFIX, output_path + ETAG_SUFFIX)):
+            if not os.path.exists(source):
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+
+    def _process_one(self, app: Dict) -> Tuple[List[str], str]:
+        """Run _process_app in a worker, returning its held output and status message for the main thread"""
+        self._worker_output.lines = []
+        try:
+            message = self._process_app(app)
+        except Exception as e:
+            message = f"Error processing {app['domain']}: {e}"
+        finally:
+            lines = self._worker_output.lines
+            self._worker_output.lines = None
+        return lines, message
+
+    def _process_app(self, app: Dict) -> str:
+        """Retrieve info and download the JAR for a single application, returning a status message"""
+        app_name = app['domain']
+        app_info = self.get_application_info(app_name)
+        filename = app_info.get('filename')
+
+        if not filename:
+            return f"Filename not found for {app_name}, skipping\nReceived JSON: {_dumps(app_info, pretty=True).decode('utf-8')}"
+
+        output_path = self.download_application(app_name, filename)
+
+        if output_path:
+            return f"Download completed: {output_path}"
+        return f"Download failed for {app_name}"
+
+    def _report_finished(self, pending: Dict, completed: int, total: int, progress) -> int:
+        """Wait for at least one pending task, print its output and return the updated completed count"""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            app_name = pending.pop(future)
+            try:
+                lines, message = future.result()
+            except Exception as e:
+                lines, message = [], f"Error processing {app_name}: {e}"
+
+            completed += 1
+            output = "\n".join(lines + [f"[{completed}/{total}] {message}"])
+            if progress is not None:
+                progress.write(output)
+                progress.update()
+            else:
+                print(output)
+        return completed
+
     def process_all_applications(self) -> None:
         """Process all applications: retrieve info and download JARs"""
         print("Starting applications download process...")
@@ -158,41 +462,34 @@ class MulesoftDownloader:
             print(f"\nFound {total_apps} applications to process")
             
             # Save applications JSON to root
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            json_filename = f"applications_list_{timestamp}.json"
+            json_filename = f"applications_list_{self.timestamp}.json"
             json_path = os.path.join(self.download_dir, json_filename)
             
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(applications, f, indent=2)
+            with open(json_path, 'wb') as f:
+                f.write(_dumps(applications, pretty=self.pretty_json))
             print(f"Saved applications JSON to: {json_path}")
 
-            for index, app in enumerate(applications, 1):
-                app_name = app.get('domain')
-                if not app_name:
-                    continue
-
-                print(f"\nProcessing application {index} of {total_apps}: {app_name}")
-                
-                try:
-                    app_info = self.get_application_info(app_name)
-                    filename = app_info.get('filename')
-                    
-                    if not filename:
-                        print(f"Filename not found for {app_name}, skipping")
-                        print("Received JSON:", json.dumps(app_info, indent=2))
-                        continue
-
-                    print(f"Downloading file: {filename}")
-                    output_path = self.download_application(app_name, filename)
-                    
-                    if output_path:
-                        print(f"Download completed: {output_path}")
-                    else:
-                        print(f"Download failed for {app_name}")
-
-                except Exception as e:
-                    print(f"Error processing {app_name}: {e}")
-                    continue
+            apps_to_process = [app for app in applications if app.get('domain')]
+            self._create_app_dirs(app['domain'] for app in apps_to_process)
+
+            total = len(apps_to_process)
+            progress = tqdm(total=total, unit="app") if tqdm else None
+            completed = 0
+
+            # Keep only a bounded number of tasks queued, submitting more as workers finish.
+            # Workers hold their output and return it, the main thread does the printing
+            max_pending = 2 * self.max_workers
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = {}
+                for app in apps_to_process:
+                    pending[executor.submit(self._process_one, app)] = app['domain']
+                    if len(pending) >= max_pending:
+                        completed = self._report_finished(pending, completed, total, progress)
+                while pending:
+                    completed = self._report_finished(pending, completed, total, progress)
+
+            if progress is not None:
+                progress.close()
 
         except Exception as e:
             print(f"Error during process: {e}")